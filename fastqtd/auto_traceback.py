@@ -7,13 +7,30 @@ Auto-traceback module:
 """
 
 import time, json
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
+from itertools import chain
 from .db import fetch_traces_for_account, add_traceback
 
 # Simple in-memory simulated ledger for demo. In production, replace this with bank/ledger API calls.
 # Format: { 'txn_id': {'from': acct, 'to': acct, 'amount': 100, 'timestamp': ...} }
 SIM_LEDGER = {}
+# Secondary index: { from_acct: [txn_id, ...] } so BFS doesn't scan the whole ledger per account.
+FROM_INDEX = defaultdict(list)
+
+# Worker threads for fanning out independent DB reads (WAL lets readers run concurrently).
+DB_READ_WORKERS = 8
+
+# Field order of the per-txn tuples collected during BFS; boxed into dicts only on return.
+_TXN_FIELDS = ('txn_id', 'from', 'to', 'amount', 'timestamp')
 
 def register_simulated_txn(txn_id, from_acct, to_acct, amount):
+    if txn_id not in SIM_LEDGER:
+        FROM_INDEX[from_acct].append(txn_id)
+    elif SIM_LEDGER[txn_id]['from'] != from_acct:
+        # re-registration under a different sender: move the index entry
+        FROM_INDEX[SIM_LEDGER[txn_id]['from']].remove(txn_id)
+        FROM_INDEX[from_acct].append(txn_id)
     SIM_LEDGER[txn_id] = {
         'from': from_acct,
         'to': to_acct,
@@ -21,58 +38,65 @@ def register_simulated_txn(txn_id, from_acct, to_acct, amount):
         'timestamp': time.time()
     }
 
-def build_graph_from_start_account(start_account, max_hops=5):
+def _graph_result(start_account, results, hops, target_account, reached):
+    out = {
+        'start_account': start_account,
+        'txns': [dict(zip(_TXN_FIELDS, r)) for r in results],
+        'hops_searched': hops
+    }
+    if target_account is not None:
+        out['target_account'] = target_account
+        out['target_reached'] = reached
+    return out
+
+def build_graph_from_start_account(start_account, max_hops=5, target_account=None):
     """
     BFS over SIM_LEDGER edges finding all transactions originating from start_account,
-    following to subsequent accounts (mule flows).
+    following to subsequent accounts (mule flows). Edges are looked up via FROM_INDEX.
+    If target_account is given, stop as soon as a txn paying into it is seen and report
+    'target_reached' (txns then holds only the edges explored so far).
     """
     try:
-        visited_accounts = set()
-        visited_txns = set()
+        # BFS over a single deque of (account, depth). The start account is marked visited
+        # up front, so every account is expanded at most once; since each txn has exactly
+        # one sender, that also means each txn is emitted at most once.
+        visited_accounts = {start_account}
         results = []
 
-        queue = [start_account]
+        queue = deque([(start_account, 0)])
         hops = 0
-        while queue and hops < max_hops:
-            next_queue = []
-            for acct in queue:
-                # fetch ledger txns where 'from' == acct
-                for txn_id, txn in list(SIM_LEDGER.items()):
-                    if txn['from'] == acct and txn_id not in visited_txns:
-                        visited_txns.add(txn_id)
-                        results.append({
-                            'txn_id': txn_id,
-                            'from': txn['from'],
-                            'to': txn['to'],
-                            'amount': txn['amount'],
-                            'timestamp': txn['timestamp']
-                        })
-                        if txn['to'] not in visited_accounts:
-                            next_queue.append(txn['to'])
-                            visited_accounts.add(txn['to'])
-            queue = next_queue
-            hops += 1
+        while queue:
+            acct, depth = queue.popleft()
+            if depth >= max_hops:
+                break
+            hops = depth + 1
+            # fetch ledger txns where 'from' == acct
+            for txn_id in FROM_INDEX.get(acct, ()):
+                txn = SIM_LEDGER[txn_id]
+                to_acct = txn['to']
+                results.append((txn_id, acct, to_acct, txn['amount'], txn['timestamp']))
+                if target_account is not None and to_acct == target_account:
+                    return _graph_result(start_account, results, hops, target_account, True)
+                if to_acct not in visited_accounts:
+                    visited_accounts.add(to_acct)
+                    queue.append((to_acct, hops))
 
-        return {
-            'start_account': start_account,
-            'txns': results,
-            'hops_searched': hops
-        }
+        return _graph_result(start_account, results, hops, target_account, False)
     except Exception as e:
         add_traceback('build_graph_from_start_account', e)
         raise
 
-def trace_subtransactions_for_txn(txn_id, max_depth=5):
+def trace_subtransactions_for_txn(txn_id, max_depth=5, target_account=None):
     """
     For a given txn_id, trace forward all child txns where 'from' == original 'to' and so on.
-    Returns a list of sub-transactions.
+    Returns a list of sub-transactions. See build_graph_from_start_account for target_account.
     """
     try:
         if txn_id not in SIM_LEDGER:
             return {'txn_id': txn_id, 'found': False, 'sub_txns': []}
         root = SIM_LEDGER[txn_id]
         start_acct = root['to']
-        return build_graph_from_start_account(start_acct, max_hops=max_depth)
+        return build_graph_from_start_account(start_acct, max_hops=max_depth, target_account=target_account)
     except Exception as e:
         add_traceback('trace_subtransactions_for_txn', e)
         raise
@@ -84,16 +108,21 @@ def trace_using_db(account_id, max_hops=4):
     """
     try:
         rows = fetch_traces_for_account(account_id)
-        aggregated = []
-        for r in rows:
-            aggregated.append(r['path'])
-        # flatten and unique
-        flat = []
-        for p in aggregated:
-            for a in p:
-                if a not in flat:
-                    flat.append(a)
+        # flatten and unique (order-preserving); chain + dict.fromkeys keep the loop in C
+        flat = list(dict.fromkeys(chain.from_iterable(r['path'] for r in rows)))
         return {'account': account_id, 'aggregated_paths': flat, 'rows_used': len(rows)}
     except Exception as e:
         add_traceback('trace_using_db', e)
         raise
+
+def trace_using_db_multi(account_ids, max_hops=4):
+    """
+    trace_using_db for several accounts, reading them concurrently from a thread pool
+    (each worker thread uses its own cached DB connection). Results keep input order.
+    """
+    account_ids = list(account_ids)
+    if not account_ids:
+        return []
+    workers = min(DB_READ_WORKERS, len(account_ids))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda a: trace_using_db(a, max_hops=max_hops), account_ids))
@@ -1,11 +1,15 @@
 # fastqtd/cli.py
+import json
 import click
-from .engine import detect_transaction, trace_account, freeze_transaction, recover_transaction_by_ai, instant_revert, register_sim_txn
-from .qcrypto import encrypt_file, decrypt_file
+from .engine import detect_transaction, detect_transactions_batch, trace_account, freeze_transaction, recover_transaction_by_ai, instant_revert, register_sim_txn
+from .qcrypto import encrypt_files, decrypt_file
 from .scamalert import send_alert
 from .legalconnect import report_case
 from .db import fetch_tracebacks
-from .auto_traceback import trace_subtransactions_for_txn, build_graph_from_start_account, trace_using_db
+from .auto_traceback import trace_subtransactions_for_txn, build_graph_from_start_account, trace_using_db, trace_using_db_multi
+
+# Single shared encoder for CLI output; default=str keeps non-JSON values printable.
+json_dump = json.JSONEncoder(indent=2, default=str).encode
 
 @click.group()
 def cli():
@@ -19,6 +23,13 @@ def detect(txn):
     result = detect_transaction(txn)
     click.echo(result)
 
+@cli.command()
+@click.option('--txn', 'txns', required=True, multiple=True, help='Transaction ID (repeatable)')
+def detect_batch(txns):
+    """Detect fraud for several transactions in one model call"""
+    results = detect_transactions_batch(txns)
+    click.echo(json_dump(results))
+
 @cli.command()
 @click.option('--account', required=True, help='Account ID')
 def trace(account):
@@ -53,17 +64,26 @@ def instant_revert_cmd(txn, amount):
 @cli.command()
 @click.option('--txn', required=True, help='Transaction ID to trace sub-transactions for (simulated ledger)')
 @click.option('--depth', default=5, type=int, help='Max depth/hops to trace')
-def auto_trace(txn, depth):
+@click.option('--target', default=None, help='Stop as soon as funds reach this account')
+def auto_trace(txn, depth, target):
     """Trace sub-transactions originated from a txn's recipient (demo-mode)"""
-    res = trace_subtransactions_for_txn(txn, max_depth=depth)
+    res = trace_subtransactions_for_txn(txn, max_depth=depth, target_account=target)
     click.echo(json_dump(res))
 
 @cli.command()
 @click.option('--account', required=True, help='Start account for auto tracing (simulated ledger)')
 @click.option('--hops', default=5, type=int, help='Hops to search')
-def auto_trace_account(account, hops):
+@click.option('--target', default=None, help='Stop as soon as funds reach this account')
+def auto_trace_account(account, hops, target):
     """Auto-trace forward flows for a starting account (demo-mode)"""
-    res = build_graph_from_start_account(account, max_hops=hops)
+    res = build_graph_from_start_account(account, max_hops=hops, target_account=target)
+    click.echo(json_dump(res))
+
+@cli.command()
+@click.option('--account', 'accounts', required=True, multiple=True, help='Account ID (repeatable)')
+def auto_trace_multi(accounts):
+    """Aggregate stored DB traces for several accounts (read in parallel)"""
+    res = trace_using_db_multi(accounts)
     click.echo(json_dump(res))
 
 @cli.command()
@@ -77,11 +97,11 @@ def register_txn(txn, from_acct, to_acct, amount):
     click.echo(json_dump(res))
 
 @cli.command()
-@click.option('--file', 'file_path', required=True, help='File to encrypt')
-def encrypt(file_path):
-    """Encrypt file with quantum-safe crypto (placeholder AES-GCM)"""
-    encrypted_path = encrypt_file(file_path)
-    click.echo(f'Encrypted file: {encrypted_path}')
+@click.option('--file', 'file_paths', required=True, multiple=True, help='File to encrypt (repeatable)')
+def encrypt(file_paths):
+    """Encrypt file(s) with quantum-safe crypto (placeholder AES-GCM)"""
+    for encrypted_path in encrypt_files(file_paths):
+        click.echo(f'Encrypted file: {encrypted_path}')
 
 @cli.command()
 @click.option('--file', 'file_path', required=True, help='File to decrypt')
@@ -111,12 +131,5 @@ def traceback_log(limit):
     rows = fetch_tracebacks(limit)
     click.echo(rows)
 
-def json_dump(obj):
-    try:
-        import json
-        return json.dumps(obj, indent=2)
-    except Exception:
-        return str(obj)
-
 if __name__ == '__main__':
     cli()
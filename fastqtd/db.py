@@ -3,26 +3,87 @@ import os
 import sqlite3
 import json
 import time
+import atexit
+import queue
+import threading
 import traceback
+import weakref
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
 from typing import List, Dict, Any
 
+try:
+    # optional faster (de)serializer for stored JSON columns
+    import orjson
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+__all__ = [
+    'DB_PATH', 'get_conn', 'close_all_conns', 'batch', 'init_db',
+    'log_detection', 'log_detection_raw', 'log_detections_bulk', 'add_trace', 'add_traces_bulk',
+    'add_alert', 'add_report', 'add_freeze', 'add_recovery', 'add_traceback',
+    'add_reversal', 'flush_tracebacks', 'fetch_tracebacks', 'fetch_traces_for_account', 'fetch_table',
+]
+
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'fastqtd.db')
 
 # Tunables
 DEFAULT_TIMEOUT = 30.0          # sqlite3 connect timeout (seconds)
 MAX_WRITE_RETRIES = 6           # number of times to retry on "database is locked"
 RETRY_BASE_DELAY = 0.05         # base delay (seconds) for exponential backoff
+TRACEBACK_FRAME_LIMIT = 20      # innermost stack frames kept in a stored traceback
+TB_QUEUE_MAXSIZE = 10000        # pending tracebacks before falling back to the log file
+TB_BATCH_SIZE = 500             # max tracebacks written per transaction
+MMAP_SIZE = 256 * 1024 * 1024   # bytes of the DB file sqlite may memory-map per connection
+STATEMENT_CACHE_SIZE = 128      # sqlite3 compiled-statement cache size per connection
+
+# Statement text for the hot helpers. sqlite3 keeps a per-connection cache of compiled
+# statements keyed by SQL text; with one long-lived connection per thread, reusing these
+# exact strings means each statement is prepared once per thread.
+_SQL_ADD_DETECTION = 'INSERT INTO detections (txn_id, result_json, created_at) VALUES (?, ?, ?)'
+_SQL_ADD_TRACE = 'INSERT INTO traces (account_id, path_json, created_at) VALUES (?, ?, ?)'
+_SQL_ADD_ALERT = 'INSERT INTO alerts (alert_json, created_at) VALUES (?, ?)'
+_SQL_ADD_REPORT = 'INSERT INTO reports (report_json, created_at) VALUES (?, ?)'
+_SQL_ADD_FREEZE = 'INSERT INTO freezes (txn_id, reason, meta_json, created_at) VALUES (?, ?, ?, ?)'
+_SQL_ADD_RECOVERY = 'INSERT INTO recoveries (txn_id, recovery_json, success, created_at) VALUES (?, ?, ?, ?)'
+_SQL_ADD_TRACEBACK = 'INSERT INTO tracebacks (context, traceback_text, created_at) VALUES (?, ?, ?)'
+_SQL_ADD_REVERSAL = 'INSERT INTO reversals (txn_id, reversal_txn_id, amount, meta_json, created_at) VALUES (?, ?, ?, ?, ?)'
+_SQL_FETCH_TRACEBACKS = 'SELECT id, context, traceback_text, created_at FROM tracebacks ORDER BY id DESC LIMIT ?'
+_SQL_FETCH_TRACES = 'SELECT id, account_id, path_json, created_at FROM traces WHERE account_id = ? ORDER BY id DESC'
+
+# Directory already created by _ensure_db_dir (None until first call).
+_DB_DIR_READY = None
+_INIT_LOCK = threading.Lock()
 
 def _ensure_db_dir():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    global _DB_DIR_READY
+    db_dir = os.path.dirname(DB_PATH)
+    if _DB_DIR_READY == db_dir:
+        return
+    with _INIT_LOCK:
+        if _DB_DIR_READY != db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+            _DB_DIR_READY = db_dir
 
-def get_conn():
-    """
-    Return a new sqlite3.Connection configured for better concurrency.
-    Always create a new connection per operation (recommended).
-    """
+# Per-thread cached connection (see get_conn). Each one is closed when its thread object
+# goes away (weakref.finalize), and is tracked here by id -> (conn, owner thread ref) so
+# close_all_conns can sweep whatever is still open. Bumping _CONN_GEN makes every thread
+# reopen (and close its old connection itself) on next use.
+_TLS = threading.local()
+_OPEN_CONNS = {}
+_OPEN_CONNS_LOCK = threading.Lock()
+_CONN_GEN = 0
+
+def _open_conn():
     _ensure_db_dir()
-    conn = sqlite3.connect(DB_PATH, timeout=DEFAULT_TIMEOUT, check_same_thread=False)
+    conn = sqlite3.connect(DB_PATH, timeout=DEFAULT_TIMEOUT, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row
     # Enable WAL mode for better concurrent reads/writes (reader won't block writer as much)
     # and set synchronous to NORMAL for better performance without losing much safety.
@@ -30,33 +91,87 @@ def get_conn():
         conn.execute("PRAGMA journal_mode=WAL;")
         conn.execute("PRAGMA synchronous=NORMAL;")
         conn.execute("PRAGMA foreign_keys = ON;")
+        # temp tables/indices in RAM, and read the DB file through a memory map
+        conn.execute("PRAGMA temp_store=MEMORY;")
+        conn.execute(f"PRAGMA mmap_size={int(MMAP_SIZE)};")
     except Exception:
         # Ignore if pragmas fail for some reason, but continue
         pass
     return conn
 
-def _execute_write(sql: str, params: tuple = ()):
+def _release_conn(conn):
+    with _OPEN_CONNS_LOCK:
+        _OPEN_CONNS.pop(id(conn), None)
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+def get_conn():
+    """
+    Return the calling thread's sqlite3.Connection, opening and configuring it on first use.
+    The connection is reused for the thread's lifetime and closed once the thread is gone;
+    a new one is opened after fork() (pid changes), if DB_PATH is repointed, or after
+    close_all_conns(). Callers must not close it.
+    """
+    key = (os.getpid(), DB_PATH, _CONN_GEN)
+    conn = getattr(_TLS, 'conn', None)
+    if conn is not None:
+        if _TLS.key == key:
+            return conn
+        if _TLS.key[0] == key[0]:
+            _TLS.finalizer()        # stale path/generation: close it now
+        else:
+            _TLS.finalizer.detach()  # inherited across fork(): belongs to the parent
+    conn = _open_conn()
+    thread = threading.current_thread()
+    with _OPEN_CONNS_LOCK:
+        _OPEN_CONNS[id(conn)] = (conn, weakref.ref(thread))
+    _TLS.conn = conn
+    _TLS.key = key
+    # atexit=False: at shutdown close_all_conns runs after flush_tracebacks, and must not
+    # be preceded by a finalizer closing a connection the traceback writer still uses
+    _TLS.finalizer = fin = weakref.finalize(thread, _release_conn, conn)
+    fin.atexit = False
+    return conn
+
+@atexit.register
+def close_all_conns():
+    """
+    Close the calling thread's connection and those of threads that have exited. Other
+    live threads' connections are never closed under them: they are retired by their own
+    thread on its next DB call (or by its finalizer). Every thread reopens transparently.
+    """
+    global _CONN_GEN
+    current = threading.current_thread()
+    with _OPEN_CONNS_LOCK:
+        _CONN_GEN += 1
+        conns = []
+        for conn_id, (conn, owner_ref) in list(_OPEN_CONNS.items()):
+            owner = owner_ref()
+            if owner is None or owner is current or not owner.is_alive():
+                conns.append(conn)
+                del _OPEN_CONNS[conn_id]
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+def _write_runs(runs):
     """
-    Execute a single write (INSERT/UPDATE/DELETE) with retries on 'database is locked'.
-    Commits with the connection context manager to ensure proper commit/rollback.
+    Execute runs of (sql, seq_of_params) in one transaction with retries on 'database is
+    locked'. Commits with the connection context manager to ensure proper commit/rollback.
     """
     attempt = 0
     while True:
         try:
             conn = get_conn()
-            try:
-                with conn:
-                    cur = conn.cursor()
-                    cur.execute(sql, params)
-                # success, close and return
-                conn.close()
-                return
-            finally:
-                # ensure closed even if commit fails (with conn: should handle it)
-                try:
-                    conn.close()
-                except Exception:
-                    pass
+            # `with conn:` commits on success and rolls back on error
+            with conn:
+                for sql, seq_of_params in runs:
+                    conn.executemany(sql, seq_of_params)
+            return
         except sqlite3.OperationalError as e:
             msg = str(e).lower()
             if 'locked' in msg and attempt < MAX_WRITE_RETRIES:
@@ -67,18 +182,56 @@ def _execute_write(sql: str, params: tuple = ()):
             # re-raise the original OperationalError after attempts
             raise
 
-def _execute_fetchall(sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+def _execute_write(sql: str, params: tuple = ()):
+    """
+    Execute a single write (INSERT/UPDATE/DELETE) in its own transaction, or buffer it
+    if the calling thread is inside batch().
+    """
+    pending = getattr(_TLS, 'pending', None)
+    if pending is not None:
+        pending.append((sql, params))
+        return
+    _write_runs([(sql, (params,))])
+
+def _execute_write_many(sql: str, seq_of_params):
     """
-    Execute a SELECT and return rows. Uses its own connection and closes it.
+    Execute the same write for every params tuple in seq_of_params using one connection
+    and a single transaction (one commit for the whole batch), or buffer them inside batch().
     """
-    conn = get_conn()
+    seq_of_params = list(seq_of_params)
+    if not seq_of_params:
+        return
+    pending = getattr(_TLS, 'pending', None)
+    if pending is not None:
+        pending.extend((sql, params) for params in seq_of_params)
+        return
+    _write_runs([(sql, seq_of_params)])
+
+@contextmanager
+def batch():
+    """
+    Buffer every write made by this thread inside the block and flush them on exit in a
+    single transaction (one executemany per run of identical statements, order kept).
+    Nested batch() blocks join the outermost one. Reads inside the block do not see
+    buffered rows. Pending writes are flushed even if the block raises.
+    """
+    if getattr(_TLS, 'pending', None) is not None:
+        yield
+        return
+    _TLS.pending = []
     try:
-        cur = conn.cursor()
-        cur.execute(sql, params)
-        rows = cur.fetchall()
-        return rows
+        yield
     finally:
-        conn.close()
+        pending, _TLS.pending = _TLS.pending, None
+        if pending:
+            _write_runs([(sql, [params for _, params in run])
+                         for sql, run in groupby(pending, key=itemgetter(0))])
+
+def _execute_fetchall(sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+    """
+    Execute a SELECT and return rows using the thread's cached connection.
+    """
+    return get_conn().execute(sql, params).fetchall()
 
 # --- Schema initialization ---
 def init_db():
@@ -151,7 +304,11 @@ def init_db():
             meta_json TEXT,
             created_at REAL
         )
-        '''
+        ''',
+        # Indexes. traces is looked up by account (fetch_traces_for_account); the rowid is
+        # implicitly part of the index so ORDER BY id DESC is served without a sort.
+        'CREATE INDEX IF NOT EXISTS idx_traces_account ON traces(account_id)',
+        'CREATE INDEX IF NOT EXISTS idx_detections_txn ON detections(txn_id)'
     ]
     for sql in tables:
         _execute_write(sql, ())
@@ -160,85 +317,161 @@ def init_db():
 
 def log_detection(result: dict):
     _execute_write(
-        'INSERT INTO detections (txn_id, result_json, created_at) VALUES (?, ?, ?)',
-        (result.get('txn_id'), json.dumps(result), result.get('checked_at', time.time()))
+        _SQL_ADD_DETECTION,
+        (result.get('txn_id'), _json_dumps(result), result.get('checked_at', time.time()))
+    )
+
+def log_detection_raw(txn_id, payload: str, checked_at=None):
+    """log_detection for a result the caller has already serialized to JSON text."""
+    _execute_write(
+        _SQL_ADD_DETECTION,
+        (txn_id, payload, checked_at or time.time())
     )
 
-def add_trace(account_id, path):
+def add_trace(account_id, path, created_at=None):
     _execute_write(
-        'INSERT INTO traces (account_id, path_json, created_at) VALUES (?, ?, ?)',
-        (account_id, json.dumps(path), time.time())
+        _SQL_ADD_TRACE,
+        (account_id, _json_dumps(path), created_at or time.time())
+    )
+
+def log_detections_bulk(results):
+    now = time.time()
+    _execute_write_many(
+        _SQL_ADD_DETECTION,
+        ((r.get('txn_id'), _json_dumps(r), r.get('checked_at', now)) for r in results)
+    )
+
+def add_traces_bulk(rows):
+    """rows: iterable of (account_id, path) pairs."""
+    now = time.time()
+    _execute_write_many(
+        _SQL_ADD_TRACE,
+        ((account_id, _json_dumps(path), now) for account_id, path in rows)
     )
 
 def add_alert(payload):
     _execute_write(
-        'INSERT INTO alerts (alert_json, created_at) VALUES (?, ?)',
-        (json.dumps(payload), time.time())
+        _SQL_ADD_ALERT,
+        (_json_dumps(payload), time.time())
     )
 
 def add_report(payload):
     _execute_write(
-        'INSERT INTO reports (report_json, created_at) VALUES (?, ?)',
-        (json.dumps(payload), time.time())
+        _SQL_ADD_REPORT,
+        (_json_dumps(payload), time.time())
     )
 
-def add_freeze(txn_id, reason, meta=None):
+def add_freeze(txn_id, reason, meta=None, created_at=None):
     _execute_write(
-        'INSERT INTO freezes (txn_id, reason, meta_json, created_at) VALUES (?, ?, ?, ?)',
-        (txn_id, reason, json.dumps(meta or {}), time.time())
+        _SQL_ADD_FREEZE,
+        (txn_id, reason, _json_dumps(meta or {}), created_at or time.time())
     )
 
-def add_recovery(txn_id, recovery_info, success):
+def add_recovery(txn_id, recovery_info, success, created_at=None):
     _execute_write(
-        'INSERT INTO recoveries (txn_id, recovery_json, success, created_at) VALUES (?, ?, ?, ?)',
-        (txn_id, json.dumps(recovery_info), 1 if success else 0, time.time())
+        _SQL_ADD_RECOVERY,
+        (txn_id, _json_dumps(recovery_info), 1 if success else 0, created_at or time.time())
     )
 
+def _write_traceback_fallback(rows, error):
+    # If writing tracebacks fails (DB locked/broken), fallback to a log file (avoid recursion)
+    try:
+        with open(os.path.join(os.path.dirname(__file__), '..', 'data', 'traceback_fallback.log'), 'a') as fh:
+            for context, tb_text, _created_at in rows:
+                fh.write(f"[{time.time()}] Failed to write traceback to DB for context={context}. Exception: {error}\n")
+                if tb_text != 'no-exception':
+                    fh.write(tb_text + "\n")
+    except Exception:
+        # give up silently to avoid crashing further
+        pass
+
+# Tracebacks are queued by add_traceback and written by one background thread, which
+# batches whatever is pending into a single transaction.
+_TB_QUEUE = queue.Queue(maxsize=TB_QUEUE_MAXSIZE)
+_TB_WORKER_PID = None
+_TB_WORKER_LOCK = threading.Lock()
+
+def _tb_worker():
+    while True:
+        batch = [_TB_QUEUE.get()]
+        try:
+            while len(batch) < TB_BATCH_SIZE:
+                batch.append(_TB_QUEUE.get_nowait())
+        except queue.Empty:
+            pass
+        try:
+            _execute_write_many(_SQL_ADD_TRACEBACK, batch)
+        except Exception as e:
+            _write_traceback_fallback(batch, e)
+        finally:
+            for _ in batch:
+                _TB_QUEUE.task_done()
+
+def _ensure_tb_worker():
+    global _TB_WORKER_PID
+    pid = os.getpid()
+    if _TB_WORKER_PID == pid:
+        return
+    with _TB_WORKER_LOCK:
+        if _TB_WORKER_PID != pid:
+            threading.Thread(target=_tb_worker, name='fastqtd-traceback-writer', daemon=True).start()
+            _TB_WORKER_PID = pid
+
 def add_traceback(context, exc: Exception = None):
-    # Build traceback text safely (don't attempt to call add_traceback if DB is already failing repeatedly)
+    """
+    Queue a traceback row for the background writer; never blocks. If the queue is full
+    the row goes straight to the fallback log file.
+    """
+    tb_text = 'no-exception'
     try:
-        tb_text = None
         if exc is not None:
-            tb_text = ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__))
-        else:
-            tb_text = 'no-exception'
-        _execute_write(
-            'INSERT INTO tracebacks (context, traceback_text, created_at) VALUES (?, ?, ?)',
-            (context, tb_text, time.time())
-        )
+            tb_text = ''.join(traceback.TracebackException.from_exception(exc, limit=-TRACEBACK_FRAME_LIMIT).format())
+        row = (context, tb_text, time.time())
+        _ensure_tb_worker()
+        _TB_QUEUE.put_nowait(row)
+    except queue.Full as e:
+        _write_traceback_fallback([row], e)
     except Exception as e:
-        # If writing tracebacks fails (DB locked/broken), fallback to stderr file (avoid recursion)
-        try:
-            with open(os.path.join(os.path.dirname(__file__), '..', 'data', 'traceback_fallback.log'), 'a') as fh:
-                fh.write(f"[{time.time()}] Failed to write traceback to DB for context={context}. Exception: {e}\n")
-                if exc is not None:
-                    fh.write(tb_text + "\n")
-        except Exception:
-            # give up silently to avoid crashing further
-            pass
+        _write_traceback_fallback([(context, tb_text, None)], e)
+
+@atexit.register
+def flush_tracebacks():
+    """Block until every queued traceback has been written (or sent to the fallback log)."""
+    if _TB_WORKER_PID == os.getpid():
+        _TB_QUEUE.join()
+
+def _rows_to_dicts(rows, keys):
+    """Map rows to dicts positionally; keys must follow the SELECT column order."""
+    return [dict(zip(keys, r)) for r in rows]
+
+_TRACEBACK_KEYS = ('id', 'context', 'traceback', 'created_at')
 
 def fetch_tracebacks(limit=50) -> List[Dict[str, Any]]:
+    flush_tracebacks()
     rows = _execute_fetchall(
-        'SELECT id, context, traceback_text, created_at FROM tracebacks ORDER BY id DESC LIMIT ?',
+        _SQL_FETCH_TRACEBACKS,
         (limit,)
     )
-    return [{'id': r['id'], 'context': r['context'], 'traceback': r['traceback_text'], 'created_at': r['created_at']} for r in rows]
+    return _rows_to_dicts(rows, _TRACEBACK_KEYS)
 
-def add_reversal(txn_id, reversal_txn_id, amount, meta=None):
+def add_reversal(txn_id, reversal_txn_id, amount, meta=None, created_at=None):
     _execute_write(
-        'INSERT INTO reversals (txn_id, reversal_txn_id, amount, meta_json, created_at) VALUES (?, ?, ?, ?, ?)',
-        (txn_id, reversal_txn_id, str(amount), json.dumps(meta or {}), time.time())
+        _SQL_ADD_REVERSAL,
+        (txn_id, reversal_txn_id, str(amount), _json_dumps(meta or {}), created_at or time.time())
     )
 
 def fetch_traces_for_account(account_id):
     rows = _execute_fetchall(
-        'SELECT id, account_id, path_json, created_at FROM traces WHERE account_id = ? ORDER BY id DESC',
+        _SQL_FETCH_TRACES,
         (account_id,)
     )
-    return [{'id': r['id'], 'account_id': r['account_id'], 'path': json.loads(r['path_json']), 'created_at': r['created_at']} for r in rows]
+    # positional unpacking of each Row is cheaper than four keyed lookups
+    return [{'id': i, 'account_id': a, 'path': _json_loads(p), 'created_at': c} for i, a, p, c in rows]
 
 # Optional: generic fetch helpers for other tables
 def fetch_table(name: str):
+    if name == 'tracebacks':
+        flush_tracebacks()
     rows = _execute_fetchall(f"SELECT * FROM {name} ORDER BY id ASC")
     return [dict(r) for r in rows]
 
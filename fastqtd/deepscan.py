@@ -1,14 +1,47 @@
-import time, json
+import time
+import numpy as np
 
-def scan_profile(profile_json: str):
-    """Pretend to scan a profile JSON for signs of fakeness."""
+try:
+    # optional faster parser; accepts str or bytes
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+# (key, predicate on obj.get(key), weight). A missing key is seen as None.
+_RULES = (
+    ('profile_pic', lambda v: v is None, 0.3),
+    ('bio', lambda v: v is not None and len(v) < 20, 0.2),
+    ('links', lambda v: v is not None and len(v) > 5, 0.2),
+)
+_WEIGHTS = np.array([w for _, _, w in _RULES])
+
+def _parse(profile_json):
     try:
-        obj = json.loads(profile_json)
+        obj = _loads(profile_json)
     except Exception:
-        return {'ok': False, 'reason': 'invalid json', 'score': 0.0}
+        return None
+    return obj if isinstance(obj, dict) else None
+
+def _invalid():
+    return {'ok': False, 'reason': 'invalid json', 'score': 0.0}
+
+def scan_profile(profile_json):
+    """Pretend to scan a profile JSON for signs of fakeness."""
+    obj = _parse(profile_json)
+    if obj is None:
+        return _invalid()
 
     score = 0.0
-    if 'profile_pic' not in obj: score += 0.3
-    if 'bio' in obj and len(obj['bio']) < 20: score += 0.2
-    if 'links' in obj and len(obj['links']) > 5: score += 0.2
+    for key, pred, weight in _RULES:
+        if pred(obj.get(key)):
+            score += weight
     return {'ok': True, 'fake_score': score, 'checked_at': time.time()}
+
+def scan_profiles_batch(profiles):
+    """Scan many profile JSONs; rule hits are scored together as one matrix product."""
+    objs = [_parse(p) for p in profiles]
+    valid = [o for o in objs if o is not None]
+    hits = np.array([[pred(o.get(key)) for key, pred, _ in _RULES] for o in valid], dtype=bool).reshape(-1, len(_RULES))
+    scores = iter((hits @ _WEIGHTS).tolist())
+    now = time.time()
+    return [_invalid() if o is None else {'ok': True, 'fake_score': next(scores), 'checked_at': now} for o in objs]
@@ -0,0 +1,210 @@
+# fastqtd/forest.py
+"""
+Optional numba fast path for batch fraud scoring:
+- pack_forest(clf): flatten a fitted RandomForestClassifier into contiguous node arrays
+  (plain numpy, no numba needed); save_forest/load_forest store them as a .npz bundle,
+  which scripts/train_model.py writes next to the model.
+- txn_features_batch(txn_ids): (N, 8) feature matrix, same values as engine._txn_to_features.
+- forest_predict_proba(packed, X): P(class 1) per row, walking every tree in a numba kernel.
+- quantize_forest / forest_predict_proba_q: approximate int8 variant (opt-in, see below).
+The kernels need numba; callers check HAVE_NUMBA and otherwise use sklearn directly.
+"""
+
+import importlib.util
+import threading
+import types
+import numpy as np
+
+# numba itself is only imported when a kernel is first needed (see _kernels): it adds
+# ~150 ms to every import, and most callers (CLI commands, small batches) never use it.
+HAVE_NUMBA = importlib.util.find_spec('numba') is not None
+
+_TREE_LEAF = -1     # sklearn's children_left/right marker for leaf nodes
+_N_FEATURES = 8
+_HEAD_CHARS = 20    # chars of the txn id that feed the char-code features
+_FOREST_KEYS = ('feature', 'threshold', 'left', 'right', 'leaf_value', 'tree_offset')
+
+def pack_forest(clf):
+    """
+    Concatenate all trees of a fitted forest into flat node arrays (structure of arrays).
+    Child indices are rewritten to global node positions; tree_offset[t] is the root of
+    tree t. leaf_value is the per-node fraction of predict_proba column 1, as sklearn
+    averages it. Index arrays are int32 to halve their footprint; threshold and
+    leaf_value stay float64 so scores match sklearn bit for bit (a float32 threshold can
+    round across a float32 feature value and flip the split).
+    """
+    feature, threshold, left, right, leaf_value, tree_offset = [], [], [], [], [], []
+    offset = 0
+    for est in clf.estimators_:
+        tree = est.tree_
+        value = tree.value[:, 0, :]
+        tree_offset.append(offset)
+        feature.append(tree.feature)
+        threshold.append(tree.threshold)
+        left.append(np.where(tree.children_left == _TREE_LEAF, _TREE_LEAF, tree.children_left + offset))
+        right.append(np.where(tree.children_right == _TREE_LEAF, _TREE_LEAF, tree.children_right + offset))
+        leaf_value.append(value[:, 1] / value.sum(axis=1))
+        offset += tree.node_count
+    return {
+        'feature': np.concatenate(feature).astype(np.int32),
+        'threshold': np.concatenate(threshold).astype(np.float64),
+        'left': np.concatenate(left).astype(np.int32),
+        'right': np.concatenate(right).astype(np.int32),
+        'leaf_value': np.concatenate(leaf_value).astype(np.float64),
+        'tree_offset': np.asarray(tree_offset, dtype=np.int32),
+    }
+
+def quantize_forest(packed):
+    """
+    Approximate int8 copy of a pack_forest() bundle: per feature f, values map to
+    floor(x * scale[f]), with scale[f] = 1 if every |threshold| < 127 and otherwise
+    126 / max|threshold|. Every quantized threshold then lies in [-126, 126], so clipped
+    inputs (+-127) still land on the right side of all of them. floor is monotonic, so
+    x <= t always implies xq <= tq; the only error is inputs just above a threshold that
+    share its bucket. Integer features (ASCII char codes, short lengths) keep scale 1 and
+    their half-integer thresholds, which makes them exact.
+    leaf_value is stored as float32 (numba has no CPU float16).
+    """
+    feature = packed['feature']
+    threshold = packed['threshold']
+    split = packed['left'] != _TREE_LEAF
+    max_abs = np.zeros(_N_FEATURES)
+    np.maximum.at(max_abs, feature[split], np.abs(threshold[split]))
+    scale = np.where(max_abs < 127.0, 1.0, 126.0 / np.maximum(max_abs, 1e-12))
+    threshold_q = np.zeros(threshold.size, dtype=np.int8)
+    threshold_q[split] = np.floor(threshold[split] * scale[feature[split]])
+    return {
+        'feature': feature.astype(np.int8),
+        'threshold': threshold_q,
+        'left': packed['left'],
+        'right': packed['right'],
+        'leaf_value': packed['leaf_value'].astype(np.float32),
+        'tree_offset': packed['tree_offset'],
+        'scale': scale,
+    }
+
+def quantize_features(X, scale):
+    return np.clip(np.floor(np.asarray(X, dtype=np.float64) * scale), -127, 127).astype(np.int8)
+
+def save_forest(path, packed):
+    np.savez_compressed(path, **packed)
+
+def load_forest(path):
+    with np.load(path) as data:
+        return {k: np.ascontiguousarray(data[k]) for k in _FOREST_KEYS}
+
+def _features_loop(codes, offsets, lengths, out):
+    for i in prange(lengths.size):
+        start = offsets[i]
+        m = offsets[i + 1] - start
+        s = 0.0
+        for j in range(m):
+            c = codes[start + j]
+            if j < 5:
+                out[i, j] = c
+            s += c
+        if m > 0:
+            mean = s / m
+            v = 0.0
+            for j in range(m):
+                d = codes[start + j] - mean
+                v += d * d
+            out[i, 5] = mean
+            out[i, 6] = v / m
+        out[i, 7] = lengths[i]
+
+def _forest_walk(X, feature, threshold, left, right, leaf_value, tree_offset, out):
+    # tree-major: one tree's nodes stay hot in cache while every row walks it
+    n = X.shape[0]
+    out[:] = 0.0
+    for t in range(tree_offset.size):
+        root = tree_offset[t]
+        for i in prange(n):
+            node = root
+            while left[node] != _TREE_LEAF:
+                if X[i, feature[node]] <= threshold[node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            out[i] += leaf_value[node]
+    out /= tree_offset.size
+
+def _forest_walk_q(Xq, feature, threshold_q, left, right, leaf_value, tree_offset, out):
+    # same walk as _forest_walk, but on int8 features/thresholds: integer compares only.
+    # Kept branchy on purpose: a branchless child select (children[2*node + (x > t)])
+    # and a level-synchronous walk over all rows both measured 2-3x slower here, since
+    # the select turns each step into a dependent load while the branches predict well.
+    n = Xq.shape[0]
+    out[:] = 0.0
+    for t in range(tree_offset.size):
+        root = tree_offset[t]
+        for i in prange(n):
+            node = root
+            while left[node] != _TREE_LEAF:
+                if Xq[i, feature[node]] <= threshold_q[node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            out[i] += leaf_value[node]
+    out /= tree_offset.size
+
+# parallel=True builds only run on the main thread: with numba's default workqueue
+# threading layer, launching them from other threads hangs interpreter exit. Worker
+# threads (e.g. engine.run_many) get serial builds of the same loops. Both sets are
+# disk-cached so a fresh process doesn't JIT them again; numba names cache files by
+# qualname and doesn't key them on parallel=, so the serial copies get their own name.
+def _serial_copy(f):
+    g = types.FunctionType(f.__code__, f.__globals__, f.__name__ + '_serial')
+    g.__qualname__ = f.__qualname__ + '_serial'
+    return g
+
+_PARALLEL_KERNELS = None
+_SERIAL_KERNELS = None
+_KERNELS_LOCK = threading.Lock()
+
+def _build_kernels():
+    # prange is bound as a module global here, where the loops above look it up at compile time
+    global _PARALLEL_KERNELS, _SERIAL_KERNELS, prange
+    from numba import njit, prange
+    loops = (_features_loop, _forest_walk, _forest_walk_q)
+    _PARALLEL_KERNELS = tuple(njit(parallel=True, cache=True)(f) for f in loops)
+    _SERIAL_KERNELS = tuple(njit(cache=True)(_serial_copy(f)) for f in loops)
+
+def _kernels():
+    """(features, forest, forest_q) kernels suitable for the calling thread."""
+    if _SERIAL_KERNELS is None:
+        with _KERNELS_LOCK:
+            if _SERIAL_KERNELS is None:
+                _build_kernels()
+    if threading.current_thread() is threading.main_thread():
+        return _PARALLEL_KERNELS
+    return _SERIAL_KERNELS
+
+def txn_features_batch(txn_ids):
+    """(N, 8) float32 features for txn_ids, computed in one numba kernel (needs numba)."""
+    heads = [t[:_HEAD_CHARS] for t in txn_ids]
+    n = len(heads)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, heads), dtype=np.int64, count=n), out=offsets[1:])
+    # UTF-32 gives one uint32 code point per char, i.e. ord(c) for any txn id
+    codes = np.frombuffer(''.join(heads).encode('utf-32-le'), dtype=np.uint32)
+    lengths = np.fromiter(map(len, txn_ids), dtype=np.int64, count=n)
+    out = np.zeros((n, _N_FEATURES), dtype=np.float32)
+    _kernels()[0](codes, offsets, lengths, out)
+    return out
+
+def forest_predict_proba(packed, X):
+    """P(class 1) for each row of X using a pack_forest() bundle (needs numba)."""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    out = np.empty(X.shape[0])
+    _kernels()[1](X, packed['feature'], packed['threshold'], packed['left'], packed['right'],
+                   packed['leaf_value'], packed['tree_offset'], out)
+    return out
+
+def forest_predict_proba_q(qpacked, X):
+    """Approximate P(class 1) using a quantize_forest() bundle (needs numba)."""
+    Xq = np.ascontiguousarray(quantize_features(X, qpacked['scale']))
+    out = np.empty(Xq.shape[0])
+    _kernels()[2](Xq, qpacked['feature'], qpacked['threshold'], qpacked['left'], qpacked['right'],
+                     qpacked['leaf_value'], qpacked['tree_offset'], out)
+    return out
@@ -1,52 +1,132 @@
 import os
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # NOTE: This is a placeholder encryption module using AES-GCM.
 # In production, swap to properly-vetted post-quantum encryption (NIST PQC libs) and secure key management.
 
 _MASTER_SECRET_FILE = os.path.join(os.path.dirname(__file__), '..', 'keys', 'master.key')
 
+CHUNK_SIZE = 1 << 20    # bytes read/encrypted per step when streaming files
+FILE_WORKERS = 4        # files encrypted concurrently by encrypt_files
+_NONCE_LEN = 12
+_TAG_LEN = 16
+_KEY_LOCK = threading.Lock()
+# Process-wide key caches, keyed by key file path so repointing _MASTER_SECRET_FILE works.
+_MASTER = None      # (path, master key bytes)
+_DERIVED = {}       # (path, info) -> derived key
+_BUFS = threading.local()   # per-thread streaming buffers, reused across files
+
 def _ensure_master_key():
-    key_dir = os.path.dirname(_MASTER_SECRET_FILE)
-    os.makedirs(key_dir, exist_ok=True)
-    if not os.path.exists(_MASTER_SECRET_FILE):
-        secret = secrets.token_bytes(32)
-        with open(_MASTER_SECRET_FILE, 'wb') as f:
-            f.write(secret)
-    with open(_MASTER_SECRET_FILE, 'rb') as f:
-        return f.read()
+    # serialized so concurrent first use (encrypt_files) can't create two different keys
+    global _MASTER
+    with _KEY_LOCK:
+        if _MASTER is not None and _MASTER[0] == _MASTER_SECRET_FILE:
+            return _MASTER[1]
+        key_dir = os.path.dirname(_MASTER_SECRET_FILE)
+        os.makedirs(key_dir, exist_ok=True)
+        if not os.path.exists(_MASTER_SECRET_FILE):
+            secret = secrets.token_bytes(32)
+            with open(_MASTER_SECRET_FILE, 'wb') as f:
+                f.write(secret)
+        with open(_MASTER_SECRET_FILE, 'rb') as f:
+            _MASTER = (_MASTER_SECRET_FILE, f.read())
+        return _MASTER[1]
 
 def _derive_key(info: bytes=b'fastqtd-file') -> bytes:
-    master = _ensure_master_key()
-    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info)
-    return hkdf.derive(master)
+    # HKDF output only depends on master + info, so derive each key once per process
+    cache_key = (_MASTER_SECRET_FILE, info)
+    key = _DERIVED.get(cache_key)
+    if key is None:
+        master = _ensure_master_key()
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info)
+        key = _DERIVED[cache_key] = hkdf.derive(master)
+    return key
+
+def _stream_buffers():
+    """
+    (in, out) memoryviews for _stream_update, allocated once per thread and per
+    CHUNK_SIZE, so encrypting many files doesn't zero-fill 2 MiB of fresh buffers each time.
+    """
+    bufs = getattr(_BUFS, 'views', None)
+    if bufs is None or len(bufs[0]) != CHUNK_SIZE:
+        # update_into needs len(input) + block_size - 1 bytes of output space
+        bufs = _BUFS.views = (memoryview(bytearray(CHUNK_SIZE)), memoryview(bytearray(CHUNK_SIZE + 15)))
+    return bufs
+
+def _stream_update(ctx, src, dst, nbytes=None):
+    """
+    Feed src through cipher context ctx into dst in CHUNK_SIZE pieces using preallocated
+    buffers (readinto/update_into), so memory use is O(CHUNK_SIZE) regardless of file size.
+    If nbytes is given, stop after that many input bytes.
+    """
+    view, out_view = _stream_buffers()
+    while nbytes is None or nbytes > 0:
+        want = CHUNK_SIZE if nbytes is None else min(CHUNK_SIZE, nbytes)
+        n = src.readinto(view[:want])
+        if not n:
+            break
+        written = ctx.update_into(view[:n], out_view)
+        dst.write(out_view[:written])
+        if nbytes is not None:
+            nbytes -= n
 
 def encrypt_file(path: str) -> str:
-    """Encrypt a file at path using AES-GCM and save as <path>.enc"""
+    """Encrypt a file at path using AES-GCM and save as <path>.enc (nonce || ciphertext || tag)"""
     key = _derive_key(b'file-encryption')
-    aesgcm = AESGCM(key)
-    nonce = secrets.token_bytes(12)
-    with open(path, 'rb') as f:
-        data = f.read()
-    ct = aesgcm.encrypt(nonce, data, None)
+    nonce = secrets.token_bytes(_NONCE_LEN)
+    encryptor = Cipher(algorithms.AES(key), modes.GCM(nonce)).encryptor()
     out = path + '.enc'
-    with open(out, 'wb') as f:
-        f.write(nonce + ct)
+    with open(path, 'rb') as src, open(out, 'wb') as dst:
+        dst.write(nonce)
+        _stream_update(encryptor, src, dst)
+        dst.write(encryptor.finalize())
+        dst.write(encryptor.tag)
     return out
 
+def encrypt_files(paths, max_workers: int = FILE_WORKERS) -> list:
+    """
+    Encrypt several files concurrently. Each file is streamed by encrypt_file on a worker
+    thread; file reads/writes and OpenSSL calls release the GIL, so disk I/O for one file
+    overlaps AES work on another. Returns output paths in input order.
+    """
+    paths = list(paths)
+    if len(paths) <= 1:
+        return [encrypt_file(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as executor:
+        return list(executor.map(encrypt_file, paths))
+
 def decrypt_file(path: str) -> str:
-    """Decrypt a .enc file and write to <path>.dec"""
+    """
+    Decrypt a .enc file and write to <path>.dec. Plaintext is streamed to a temporary
+    file that only replaces <path>.dec once the GCM tag has verified.
+    """
     key = _derive_key(b'file-encryption')
-    aesgcm = AESGCM(key)
-    with open(path, 'rb') as f:
-        raw = f.read()
-    nonce = raw[:12]
-    ct = raw[12:]
-    pt = aesgcm.decrypt(nonce, ct, None)
+    ct_len = os.path.getsize(path) - _NONCE_LEN - _TAG_LEN
+    if ct_len < 0:
+        raise InvalidTag()
     out = path + '.dec'
-    with open(out, 'wb') as f:
-        f.write(pt)
+    tmp = out + '.part'
+    with open(path, 'rb') as src:
+        nonce = src.read(_NONCE_LEN)
+        src.seek(-_TAG_LEN, os.SEEK_END)
+        tag = src.read(_TAG_LEN)
+        src.seek(_NONCE_LEN)
+        decryptor = Cipher(algorithms.AES(key), modes.GCM(nonce, tag)).decryptor()
+        try:
+            with open(tmp, 'wb') as dst:
+                _stream_update(decryptor, src, dst, ct_len)
+                dst.write(decryptor.finalize())
+            os.replace(tmp, out)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
     return out
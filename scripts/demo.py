@@ -6,22 +6,21 @@ Simulates a fraud case and inspects DB records.
 """
 
 import json
-from fastqtd.engine import detect_transaction, freeze_transaction, instant_revert, register_sim_txn
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from fastqtd.engine import batch, detect_transaction, freeze_transaction, instant_revert, register_sim_txns
 from fastqtd.auto_traceback import trace_subtransactions_for_txn
-from fastqtd.db import init_db, _conn
+from fastqtd.db import init_db, fetch_table
 
 def pp(obj, title=None):
     if title:
         print(f"\n--- {title} ---")
-    print(json.dumps(obj, indent=2))
-
-def fetch_table(name):
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute(f"SELECT * FROM {name}")
-    rows = cur.fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    if orjson is not None:
+        print(orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode())
+    else:
+        print(json.dumps(obj, indent=2))
 
 def run_demo():
     print("=== FAST+ QTD Demo Start ===")
@@ -31,29 +30,33 @@ def run_demo():
 
     # 2. Register mule transactions
     print("\n[Step 1] Register mule transactions...")
-    register_sim_txn("T1", "muleA", "muleB", 5000)
-    register_sim_txn("T2", "muleB", "muleC", 4000)
-    register_sim_txn("T3", "muleC", "muleD", 3900)
+    register_sim_txns([
+        ("T1", "muleA", "muleB", 5000),
+        ("T2", "muleB", "muleC", 4000),
+        ("T3", "muleC", "muleD", 3900),
+    ])
 
-    # 3. Detect fraud on T1
-    print("\n[Step 2] Detecting fraud for T1...")
-    detection = detect_transaction("T1")
-    print(detection)
+    # Steps 2-5 log their DB rows in one transaction when the block exits
+    with batch():
+        # 3. Detect fraud on T1
+        print("\n[Step 2] Detecting fraud for T1...")
+        detection = detect_transaction("T1")
+        print(detection)
 
-    # 4. Freeze only part of T1 (suspected amount = 4000)
-    print("\n[Step 3] Freezing partial amount from T1...")
-    freeze_result = freeze_transaction("T1", suspect_amount=4000, reason="pattern matched")
-    print(freeze_result)
+        # 4. Freeze only part of T1 (suspected amount = 4000)
+        print("\n[Step 3] Freezing partial amount from T1...")
+        freeze_result = freeze_transaction("T1", suspect_amount=4000, reason="pattern matched")
+        print(freeze_result)
 
-    # 5. Auto-trace mule flow starting from T1 recipient
-    print("\n[Step 4] Auto-tracing mule flow from T1...")
-    traced = trace_subtransactions_for_txn("T1", max_depth=5)
-    pp(traced)
+        # 5. Auto-trace mule flow starting from T1 recipient
+        print("\n[Step 4] Auto-tracing mule flow from T1...")
+        traced = trace_subtransactions_for_txn("T1", max_depth=5)
+        pp(traced)
 
-    # 6. Instant revert (try to recover frozen funds)
-    print("\n[Step 5] Performing instant revert for T1...")
-    revert = instant_revert("T1", requested_amount=4000)
-    print(revert)
+        # 6. Instant revert (try to recover frozen funds)
+        print("\n[Step 5] Performing instant revert for T1...")
+        revert = instant_revert("T1", requested_amount=4000)
+        print(revert)
 
     # 7. Inspect DB tables
     print("\n[Step 6] Inspecting DB records...")
@@ -1,24 +1,39 @@
 # Simple/train a synthetic sklearn model and save to models/fraud_model.pkl
-import os
 from pathlib import Path
 import joblib
 from sklearn.ensemble import RandomForestClassifier
 import numpy as np
+try:
+    from fastqtd.forest import pack_forest, save_forest
+except ImportError:
+    # package not installed yet; the engine packs the forest from the model on first use
+    pack_forest = None
 
 OUT = Path(__file__).resolve().parents[1] / "models"
 OUT.mkdir(parents=True, exist_ok=True)
-X = []
-y = []
-for i in range(500):
-    vec = list((np.random.randint(0, 128, size=5)).tolist())
-    mean = float(np.mean(vec))
-    var = float(np.var(vec))
-    ln = float(np.random.randint(1, 30))
-    feat = vec + [mean, var, ln]
-    X.append(feat)
-    y.append(1 if np.random.random() < 0.15 else 0)
+N_SAMPLES = 500
 
-clf = RandomForestClassifier(n_estimators=50, random_state=42)
+# Synthesize the whole (N, 8) feature matrix at once: 5 char codes, their mean and
+# variance, and an id length -- the same layout as fastqtd.engine._txn_to_features.
+rng = np.random.default_rng(42)
+vec = rng.integers(0, 128, size=(N_SAMPLES, 5)).astype(np.float32)
+mean = vec.mean(axis=1, keepdims=True)
+var = vec.var(axis=1, keepdims=True)
+ln = rng.integers(1, 30, size=(N_SAMPLES, 1)).astype(np.float32)
+X = np.hstack([vec, mean, var, ln])
+y = (rng.random(N_SAMPLES) < 0.15).astype(np.int8)
+
+clf = RandomForestClassifier(n_estimators=50, random_state=42, n_jobs=-1)
 clf.fit(X, y)
+# parallelism only for training; single-row scoring in the engine is faster without a pool
+clf.set_params(n_jobs=None)
 joblib.dump(clf, OUT / "fraud_model.pkl")
 print("Saved synthetic model to", str(OUT / "fraud_model.pkl"))
+# flattened node arrays for the optional numba scorer (fastqtd.forest)
+if pack_forest is not None:
+    save_forest(OUT / "forest_soa.npz", pack_forest(clf))
+    print("Saved packed forest to", str(OUT / "forest_soa.npz"))
+else:
+    # don't leave a bundle from a previous model behind
+    (OUT / "forest_soa.npz").unlink(missing_ok=True)
+    print("fastqtd not importable; packed forest will be built from the model at runtime")
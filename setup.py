@@ -11,6 +11,9 @@ setup(
         'joblib',
         'numpy'
     ],
+    extras_require={
+        'fast': ['orjson', 'numba']
+    },
     entry_points={
         'console_scripts': [
             'fastqtd=fastqtd.cli:cli'